@@ -0,0 +1,66 @@
+""" A minimal HTTP server that answers with predefined contents, to test
+    the backends without network access """
+
+import http.server
+import json
+import threading
+import time
+
+
+class MockServer(object):
+    def __init__(self, routes = None, delays = None):
+        """ ROUTES is a dictionary with the path (including the query) as
+            key, and the content to return as value. Dictionaries and lists
+            are returned as JSON, and strings as HTML. Any other path
+            returns a 404 error. DELAYS is a dictionary with the paths
+            that must wait some seconds before answering, to simulate
+            slow servers. """
+        super().__init__()
+        self.routes = routes if routes is not None else {}
+        self.delays = delays if delays is not None else {}
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(self.path)
+                if self.path in server.delays:
+                    time.sleep(server.delays[self.path])
+                if self.path not in server.routes:
+                    self._send(404, "text/plain", "Not found")
+                    return
+                content = server.routes[self.path]
+                if isinstance(content, str):
+                    self._send(200, "text/html", content)
+                else:
+                    self._send(200, "application/json", json.dumps(content))
+
+            def _send(self, status, content_type, body):
+                body = body.encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up waiting, like after a deadline
+                    pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.host = f"127.0.0.1:{self._server.server_port}"
+        self.url = f"http://{self.host}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,216 @@
+import contextlib
+import datetime
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import updatesnap
+from mock_server import MockServer
+
+CGIT_PAGE = "<html><head><meta name='generator' content='cgit v1.2.3'/></head></html>"
+
+CGIT_TAGS = ("<table class='list nowrap'><tr class='nohover'><th class='left'>Tag</th></tr>"
+             "<tr><td><a href='/pub/scm/repo.git/tag/?h=v6.1'>v6.1</a></td><td>x</td>"
+             "<td colspan='2'><span class='age-months' title='2022-12-11 14:15:38 -0800'>x</span></td></tr>"
+             "<tr><td><a href='/pub/scm/repo.git/tag/?h=v6.0%26rc'>v6.0&amp;rc</a></td><td>x</td>"
+             "<td colspan='2'><span class='age-years' title='2022-10-02 14:09:07 +0000'>x</span></td></tr></table>")
+
+GITEA_TAGS = [{"name": "v2.1.0", "commit": {"sha": "aaa", "created": "2023-05-01T10:00:00Z"}},
+              {"name": "v2.0.0", "commit": {"sha": "bbb"}}]
+
+GITEA_COMMIT = {"sha": "bbb", "commit": {"committer": {"date": "2023-01-01T10:00:00+02:00"}}}
+
+
+def save_host(cache_file, index):
+    cache = updatesnap.Cache(cache_file)
+    cache.set("hosts", f"host{index}.example.com", "gitea")
+    cache.save()
+
+
+class TestForges(unittest.TestCase):
+    def test_gitea_probe_and_tags(self):
+        routes = {"/api/v1/version": {"version": "1.21.0"},
+                  "/api/v1/repos/owner/repo/tags": GITEA_TAGS,
+                  "/api/v1/repos/owner/repo/git/commits/bbb": GITEA_COMMIT}
+        with MockServer(routes) as server:
+            forges = updatesnap.Forges(True)
+            backend, uri = forges.get_backend(f"{server.url}/owner/repo.git")
+            self.assertEqual(backend.get_type(), "gitea")
+            tags = backend.get_tags(uri)
+        # the Gitlab API is probed before the Gitea one
+        self.assertEqual(server.requests[0], "/api/v4/projects/owner%2Frepo")
+        self.assertEqual(server.requests[1], "/api/v1/version")
+        self.assertEqual(tags, [
+            {"name": "v2.1.0", "date": datetime.datetime(2023, 5, 1, 10, 0, tzinfo=datetime.timezone.utc)},
+            {"name": "v2.0.0", "date": datetime.datetime(2023, 1, 1, 10, 0,
+                                                         tzinfo=datetime.timezone(datetime.timedelta(hours=2)))}])
+
+
+    def test_gitlab_probe(self):
+        routes = {"/api/v4/projects/group%2Frepo": {"id": 3, "path_with_namespace": "group/repo"},
+                  "/api/v4/projects/group%2Frepo/repository/tags?order_by=updated&sort=desc": [
+                      {"name": "1.2.0", "commit": {"committed_date": "2022-05-01T10:00:00.000Z"}}]}
+        with MockServer(routes) as server:
+            forges = updatesnap.Forges(True)
+            backend, uri = forges.get_backend(f"{server.url}/group/repo.git")
+            self.assertEqual(backend.get_type(), "gitlab")
+            tags = backend.get_tags(uri)
+        self.assertEqual(tags[0]["name"], "1.2.0")
+        self.assertEqual(tags[0]["date"], datetime.datetime(2022, 5, 1, 10, 0, tzinfo=datetime.timezone.utc))
+
+
+    def test_cgit_with_git_suffix(self):
+        routes = {"/pub/scm/repo.git": CGIT_PAGE,
+                  "/pub/scm/repo.git/refs/tags": CGIT_TAGS}
+        with MockServer(routes) as server:
+            forges = updatesnap.Forges(True)
+            backend, uri = forges.get_backend(f"{server.url}/pub/scm/repo.git")
+            self.assertEqual(backend.get_type(), "cgit")
+            tags = backend.get_tags(uri)
+        self.assertEqual([tag["name"] for tag in tags], ["v6.1", "v6.0&rc"])
+        self.assertEqual(tags[0]["date"], datetime.datetime(2022, 12, 11, 14, 15, 38,
+                                                            tzinfo=datetime.timezone(datetime.timedelta(hours=-8))))
+        # once found, the working path is reused
+        self.assertEqual(server.requests[-1], "/pub/scm/repo.git/refs/tags")
+        self.assertNotIn("/pub/scm/repo/refs/tags", server.requests)
+
+
+    def test_cgit_without_git_suffix(self):
+        routes = {"/repo": CGIT_PAGE,
+                  "/repo/refs/tags": CGIT_TAGS}
+        with MockServer(routes) as server:
+            forges = updatesnap.Forges(True)
+            backend, uri = forges.get_backend(f"{server.url}/repo")
+            self.assertEqual(backend.get_type(), "cgit")
+            self.assertEqual(len(backend.get_tags(uri)), 2)
+
+
+    def test_host_is_cached(self):
+        routes = {"/api/v1/version": {"version": "1.21.0"}}
+        with tempfile.TemporaryDirectory() as folder:
+            cache_file = os.path.join(folder, "updatesnap.cache")
+            with MockServer(routes) as server:
+                cache = updatesnap.Cache(cache_file)
+                updatesnap.Forges(True, cache).get_backend(f"{server.url}/owner/repo.git")
+                cache.save()
+                server.requests.clear()
+                forges = updatesnap.Forges(True, updatesnap.Cache(cache_file))
+                backend, uri = forges.get_backend(f"{server.url}/owner/other.git")
+            self.assertEqual(backend.get_type(), "gitea")
+            self.assertEqual(server.requests, [])
+
+
+    def test_unsupported_repository(self):
+        snapcraft = ("parts:\n"
+                     "  part1:\n"
+                     "    source: {url}/owner/repo.git\n"
+                     "    source-tag: 1.0.0\n")
+        with MockServer() as server:
+            snap = updatesnap.Snapcraft(True)
+            snap.load_external_data(snapcraft.format(url=server.url))
+            part_data = snap.process_part("part1")
+        self.assertTrue(part_data["unsupported"])
+        self.assertIsNone(snap.get_expected_cost("part1"))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            updatesnap.print_summary([part_data])
+        self.assertIn("part1: repository not supported.", output.getvalue())
+
+
+    def test_unsupported_repository_is_cached(self):
+        routes = {"/api/v4/projects/group%2Fgood": {"id": 3, "path_with_namespace": "group/good"}}
+        with tempfile.TemporaryDirectory() as folder:
+            cache_file = os.path.join(folder, "updatesnap.cache")
+            with MockServer(routes) as server:
+                cache = updatesnap.Cache(cache_file)
+                backend, uri = updatesnap.Forges(True, cache).get_backend(f"{server.url}/group/bad.git")
+                self.assertIsNone(backend)
+                cache.save()
+
+                server.requests.clear()
+                forges = updatesnap.Forges(True, updatesnap.Cache(cache_file))
+                backend, uri = forges.get_backend(f"{server.url}/group/bad.git")
+                self.assertIsNone(backend)
+                self.assertEqual(server.requests, [])
+                # a failure in one repository doesn't affect the others in the same host
+                backend, uri = forges.get_backend(f"{server.url}/group/good.git")
+                self.assertEqual(backend.get_type(), "gitlab")
+
+                # once expired, the repository is probed again
+                cache = updatesnap.Cache(cache_file)
+                cache.set("unsupported", f"{server.host}/group/bad", time.time() - 1)
+                server.requests.clear()
+                backend, uri = updatesnap.Forges(True, cache).get_backend(f"{server.url}/group/bad.git")
+                self.assertIsNone(backend)
+                self.assertIn("/api/v4/projects/group%2Fbad", server.requests)
+
+
+    def test_forges_shared_between_snaps(self):
+        snapcraft = ("parts:\n"
+                     "  part1:\n"
+                     "    source: {url}/owner/repo.git\n"
+                     "    source-tag: 1.0.0\n")
+        with MockServer() as server:
+            forges = updatesnap.Forges(True)
+            for count in range(2):
+                snap = updatesnap.Snapcraft(True, forges = forges)
+                snap.load_external_data(snapcraft.format(url=server.url))
+                snap.process_part("part1")
+                if count == 0:
+                    server.requests.clear()
+        self.assertEqual(server.requests, [])
+
+
+    def test_unwritable_cache(self):
+        with tempfile.TemporaryDirectory() as folder:
+            # a file can't be used as a folder
+            open(os.path.join(folder, "file"), "w").close()
+            cache = updatesnap.Cache(os.path.join(folder, "file", "updatesnap.cache"))
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                cache.set("hosts", "example.com", "gitea")
+                cache.save()
+                cache.set("hosts", "example.org", "cgit")
+                cache.save()
+            self.assertEqual(output.getvalue().count("Can't write the cache file"), 1)
+            self.assertEqual(cache.get("hosts", "example.org"), "cgit")
+
+
+    def test_cache_merges_concurrent_changes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache_file = os.path.join(folder, "updatesnap.cache")
+            cache1 = updatesnap.Cache(cache_file)
+            cache2 = updatesnap.Cache(cache_file)
+            cache1.set("hosts", "example.com", "gitea")
+            cache2.set("hosts", "example.org", "cgit")
+            cache2.set("repositories", "example.org/repo", {"latency": 1.5})
+            # nothing is written until save() is called
+            self.assertFalse(os.path.exists(cache_file))
+            cache1.save()
+            cache2.save()
+            cache = updatesnap.Cache(cache_file)
+        self.assertEqual(cache.get("hosts", "example.com"), "gitea")
+        self.assertEqual(cache.get("hosts", "example.org"), "cgit")
+        self.assertEqual(cache.get("repositories", "example.org/repo"), {"latency": 1.5})
+
+
+    def test_cache_saved_from_several_processes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache_file = os.path.join(folder, "updatesnap.cache")
+            processes = [multiprocessing.Process(target=save_host, args=(cache_file, index)) for index in range(8)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            cache = updatesnap.Cache(cache_file)
+        for index in range(8):
+            self.assertEqual(cache.get("hosts", f"host{index}.example.com"), "gitea")
+
+
+if __name__ == '__main__':
+    unittest.main()
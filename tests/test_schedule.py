@@ -0,0 +1,134 @@
+import contextlib
+import io
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import updatesnap
+from mock_server import MockServer
+
+SNAPCRAFT = """parts:
+  low:
+    source: https://example.com/low.git
+  high:
+    source: https://example.com/high.git
+# ext:updatesnap
+#   priority: 10
+  wrong:
+    source: https://example.com/wrong.git
+# ext:updatesnap
+#   priority: high
+"""
+
+GITEA_TAGS = [{"name": "1.0.0", "commit": {"sha": "aaa", "created": "2023-01-01T10:00:00Z"}}]
+
+SLOW_SNAPCRAFT = """parts:
+  slow:
+    source: {url}/owner/slow.git
+    source-tag: 1.0.0
+# ext:updatesnap
+#   priority: 1
+  fast:
+    source: {url}/owner/fast.git
+    source-tag: 1.0.0
+"""
+
+COST_SNAPCRAFT = """parts:
+  expensive:
+    source: https://example.com/expensive.git
+  cheap:
+    source: https://example.com/cheap.git
+  unknown:
+    source: https://example.com/unknown.git
+  important:
+    source: https://example.com/important.git
+# ext:updatesnap
+#   priority: 5
+"""
+
+
+class TestSchedule(unittest.TestCase):
+    def test_priorities(self):
+        snap = updatesnap.Snapcraft(True)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            snap.load_external_data(SNAPCRAFT)
+        self.assertIn("Invalid priority 'high' in part wrong", output.getvalue())
+        self.assertEqual(snap.get_priority("wrong"), 0)
+
+        jobs = updatesnap.get_jobs(snap)
+        order = [jobs[position][1] for position in updatesnap.schedule_jobs(jobs)]
+        self.assertEqual(order, ["high", "low", "wrong"])
+
+
+    def test_summary_without_timed_out(self):
+        # result files written before 'timed_out' existed
+        entry = {"name": "part1", "version": None, "use_branch": False, "use_tag": True,
+                 "missing_format": True, "updates": []}
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            updatesnap.print_summary([entry])
+        self.assertEqual(output.getvalue(), "part1: needs version format definition.\n")
+
+
+    def test_cost_order(self):
+        cache = updatesnap.Cache()
+        cache.set("repositories", "example.com/expensive", {"latency": 3.0})
+        cache.set("repositories", "example.com/cheap", {"latency": 1.0})
+        cache.set("repositories", "example.com/important", {"latency": 8.0})
+        snap = updatesnap.Snapcraft(True, cache)
+        snap.load_external_data(COST_SNAPCRAFT)
+        jobs = updatesnap.get_jobs(snap)
+
+        order = [jobs[position][1] for position in updatesnap.schedule_jobs(jobs, time.monotonic() + 60)]
+        # 'unknown' is presumed to take the average time (4 seconds)
+        self.assertEqual(order, ["important", "cheap", "expensive", "unknown"])
+        # without deadline, the cost is ignored
+        order = [jobs[position][1] for position in updatesnap.schedule_jobs(jobs)]
+        self.assertEqual(order, ["important", "expensive", "cheap", "unknown"])
+
+
+    def test_deadline(self):
+        routes = {"/api/v1/version": {"version": "1.21.0"},
+                  "/api/v1/repos/owner/slow/tags": GITEA_TAGS,
+                  "/api/v1/repos/owner/fast/tags": GITEA_TAGS}
+        delays = {"/api/v1/repos/owner/slow/tags": 5}
+        cache = updatesnap.Cache()
+        with MockServer(routes, delays) as server:
+            snap = updatesnap.Snapcraft(True, cache)
+            snap.load_external_data(SLOW_SNAPCRAFT.format(url=server.url))
+            deadline = time.monotonic() + 1
+            snap.set_deadline(deadline)
+            start_time = time.monotonic()
+            results = updatesnap.process_jobs(updatesnap.get_jobs(snap), deadline)
+            elapsed = time.monotonic() - start_time
+        self.assertLess(elapsed, 3)
+        # 'slow' has higher priority, so 'fast' is reached after the deadline
+        self.assertEqual([(entry["name"], entry["timed_out"]) for entry in results],
+                         [("slow", True), ("fast", True)])
+        self.assertNotIn("/api/v1/repos/owner/fast/tags", server.requests)
+        # the time spent in 'slow' is stored as a lower bound of its cost,
+        # while 'fast' didn't start, so nothing is known about it
+        self.assertGreaterEqual(snap.get_expected_cost("slow"), 0.9)
+        self.assertIsNone(snap.get_expected_cost("fast"))
+
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            updatesnap.print_summary(results)
+        self.assertEqual(output.getvalue(), "slow: timed out before finishing the check.\n\n"
+                                            "fast: timed out before finishing the check.\n")
+
+
+    def test_timed_out_cost_is_not_lowered(self):
+        cache = updatesnap.Cache()
+        cache.set("repositories", "example.com/expensive", {"latency": 30.0})
+        snap = updatesnap.Snapcraft(True, cache)
+        snap.load_external_data(COST_SNAPCRAFT)
+        snap._store_latency("https://example.com/expensive.git", 2.0, lower_bound = True)
+        self.assertEqual(snap.get_expected_cost("expensive"), 30.0)
+        snap._store_latency("https://example.com/expensive.git", 2.0)
+        self.assertEqual(snap.get_expected_cost("expensive"), 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import updatesnap
+from mock_server import MockServer
+
+UPDATESNAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'updatesnap.py')
+
+SNAPS = {
+    "snap1": ("parts:\n"
+              "  one:\n"
+              "    source: {url}/owner/one.git\n"
+              "    source-tag: 1.0.0\n"
+              "  two:\n"
+              "    source: {url}/owner/two.git\n"
+              "    source-tag: 2.0.0\n"
+              "  tarball:\n"
+              "    source: https://example.com/tarball.tar.gz\n"),
+    "snap2": ("parts:\n"
+              "  one-again:\n"
+              "    source: {url}/owner/one/\n"
+              "    source-type: git\n"
+              "    source-tag: 1.0.0\n"
+              "  three:\n"
+              "    source: {url}/owner/three.git\n"
+              "    source-branch: main\n"
+              "  four:\n"
+              "    source: {url}/owner/four.git\n"
+              "    source-tag: 4.0.0\n"),
+}
+
+DUPLICATES = """parts:
+  dot-git:
+    source: https://example.com/owner/repo.git
+  slash:
+    source: https://example.com/owner/repo/
+    source-type: git
+  git-protocol:
+    source: git://example.com/owner/repo
+  upper-host:
+    source: https://Example.COM/owner/repo.git
+"""
+
+
+def tags(*versions):
+    return [{"name": version, "commit": {"sha": version, "created": f"2023-0{n + 1}-01T10:00:00Z"}}
+            for n, version in enumerate(versions)]
+
+
+ROUTES = {"/api/v1/version": {"version": "1.21.0"},
+          "/api/v1/repos/owner/one/tags": tags("1.0.0", "1.0.1"),
+          "/api/v1/repos/owner/two/tags": tags("2.0.0"),
+          "/api/v1/repos/owner/three/tags": tags("3.0.0"),
+          "/api/v1/repos/owner/four/tags": tags("4.0.0", "4.1.0", "4.2.0")}
+
+
+class TestShards(unittest.TestCase):
+    def _run(self, folder, *args):
+        result = subprocess.run([sys.executable, UPDATESNAP, "-s",
+                                 "--cache", os.path.join(folder, "updatesnap.cache"), *args],
+                                cwd=folder, capture_output=True, text=True, check=True)
+        return result.stdout
+
+
+    def test_sharded_run_matches_full_run(self):
+        shards = 3
+        with tempfile.TemporaryDirectory() as folder, MockServer(ROUTES) as server:
+            snaps = os.path.join(folder, "snaps")
+            for name, content in SNAPS.items():
+                os.makedirs(os.path.join(snaps, name))
+                with open(os.path.join(snaps, name, "snapcraft.yaml"), "w") as f:
+                    f.write(content.format(url=server.url))
+
+            full_output = self._run(folder, "-r", "snaps")
+
+            workers = []
+            for index in range(1, shards + 1):
+                workers.append(subprocess.Popen([sys.executable, UPDATESNAP, "-s", "-r",
+                                                 "--cache", os.path.join(folder, f"updatesnap{index}.cache"),
+                                                 "--shard", f"{index}/{shards}",
+                                                 "--output", f"shard{index}.yaml", "snaps"],
+                                                cwd=folder, stdout=subprocess.DEVNULL))
+            for worker in workers:
+                self.assertEqual(worker.wait(), 0)
+
+            merged_output = self._run(folder, "--merge", *[f"shard{index}.yaml" for index in range(1, shards + 1)])
+            shard_parts = []
+            for index in range(1, shards + 1):
+                with open(os.path.join(folder, f"shard{index}.yaml"), "r") as f:
+                    shard_parts.append([entry["name"] for entry in yaml.safe_load(f)["parts"]])
+
+        self.assertIn("four current version: 4.0.0", merged_output)
+        self.assertIn("one-again current version: 1.0.0", merged_output)
+        # the summary is printed at the end of a normal run
+        self.assertTrue(full_output.endswith(merged_output))
+        # both parts use the same repository, so they are in the same shard
+        self.assertEqual([("one" in parts, "one-again" in parts) for parts in shard_parts].count((True, True)), 1)
+
+
+    def test_duplicates_in_same_shard(self):
+        snap = updatesnap.Snapcraft(True)
+        snap.load_external_data(DUPLICATES)
+        for count in range(2, 9):
+            shards = []
+            for index in range(1, count + 1):
+                snap.set_shard(index, count)
+                shards.append([part for part in snap.get_parts() if snap._in_shard(part)])
+            self.assertEqual(sorted(len(parts) for parts in shards), [0] * (count - 1) + [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
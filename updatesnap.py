@@ -11,6 +11,9 @@ import datetime
 import argparse
 import pathlib
 import pkg_resources
+import html
+import zlib
+import fcntl
 
 class Colors(object):
     def __init__(self):
@@ -30,14 +33,137 @@ class Colors(object):
         print("\033[2K", end="\r") # clear the line
 
 
+def normalize_repository(repository):
+    """ Returns a canonical form of a repository URI, ignoring the protocol,
+        the letter case of the host name and any trailing '/' or '.git', so
+        that different spellings of the same repository are equal """
+    uri = urllib.parse.urlparse(repository.strip())
+    path = uri.path
+    while (len(path) > 0) and (path[-1] == '/'):
+        path = path[:-1]
+    if path[-4:] == '.git':
+        path = path[:-4]
+    return uri.netloc.lower() + path
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when a network request is attempted after the deadline """
+    pass
+
+
+class Cache(object):
+    """ Stores, in a YAML file, data that can be reused between runs, like
+        the backend used by each host. If no file name is given, the data
+        is kept only in memory. The changes are written only when save()
+        is called. """
+    def __init__(self, filename = None):
+        super().__init__()
+        self._colors = Colors()
+        self._filename = filename
+        self._changes = {}
+        self._data = self._read()
+
+
+    def _read(self):
+        if (self._filename is None) or (not os.path.exists(self._filename)):
+            return {}
+        try:
+            with open(self._filename, "r") as f:
+                data = yaml.safe_load(f)
+        except (OSError, yaml.YAMLError) as e:
+            print(f"{self._colors.warning}Can't read the cache file {self._filename} ({e}); ignoring it.{self._colors.reset}")
+            return {}
+        return data if isinstance(data, dict) else {}
+
+
+    def get(self, section, key, default = None):
+        if section not in self._data:
+            return default
+        return self._data[section].get(key, default)
+
+
+    def set(self, section, key, value):
+        for data in (self._data, self._changes):
+            if section not in data:
+                data[section] = {}
+            data[section][key] = value
+
+
+    def save(self):
+        """ Writes the changes to the file. Other instances (like other
+            shards) could have modified it since it was read, so, while
+            holding a lock, it is read again and the changes are merged
+            with its current contents """
+        if (self._filename is None) or (len(self._changes) == 0):
+            return
+        try:
+            folder = os.path.dirname(os.path.abspath(self._filename))
+            os.makedirs(folder, exist_ok = True)
+            with open(f"{self._filename}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                data = self._read()
+                for section, values in self._changes.items():
+                    if not isinstance(data.get(section), dict):
+                        data[section] = {}
+                    data[section].update(values)
+                # write first to a temporary file to avoid other updatesnap
+                # instances reading a partially written cache
+                tmp_filename = f"{self._filename}.{os.getpid()}.tmp"
+                with open(tmp_filename, "w") as f:
+                    yaml.safe_dump(data, f)
+                os.replace(tmp_filename, self._filename)
+        except OSError as e:
+            # the cache is just an optimization, so keep working without it
+            print(f"{self._colors.warning}Can't write the cache file {self._filename} ({e.strerror}); keeping it only in memory.{self._colors.reset}")
+            self._filename = None
+            return
+        self._changes = {}
+
+
 class GitClass(object):
-    def __init__(self, repo_type, silent = False):
+    def __init__(self, repo_type, silent = False, known_hosts = None):
         super().__init__()
         self._silent = silent
         self._token = None
         self._user = None
         self._colors = Colors()
         self._repo_type = repo_type
+        self._known_hosts = known_hosts if known_hosts is not None else []
+        self._current_tag = None
+        self._deadline = None
+
+
+    def get_type(self):
+        return self._repo_type
+
+
+    def is_known_host(self, host):
+        """ Returns True if the host is known to use this backend, so
+            there is no need to probe it """
+        return host in self._known_hosts
+
+
+    def probe(self, uri):
+        """ Returns True if the repository at URI (already parsed) can be
+            managed by this backend. Used only for unknown hosts. """
+        return False
+
+
+    def set_deadline(self, deadline):
+        """ DEADLINE is a time.monotonic() value after which no more
+            requests will be done, or None to wait forever """
+        self._deadline = deadline
+
+
+    def _remaining_time(self):
+        """ Returns the seconds until the deadline, or None if there is no
+            deadline. Raises DeadlineExceeded if it has already passed """
+        if self._deadline is None:
+            return None
+        remaining = self._deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return remaining
 
 
     def set_secrets(self, secrets):
@@ -54,14 +180,17 @@ class GitClass(object):
 
 
     def _read_uri(self, uri):
+        self._remaining_time()
         if not self._silent:
             print(f"Asking URI {uri}     ", end="\r")
         while True:
+            # without deadline, the timeout is None, so it waits forever
+            timeout = self._remaining_time()
             try:
                 if (self._user is not None) and (self._token is not None):
-                    response = requests.get(uri, auth=requests.auth.HTTPBasicAuth(self._user, self._token))
+                    response = requests.get(uri, auth=requests.auth.HTTPBasicAuth(self._user, self._token), timeout=timeout)
                 else:
-                    response = requests.get(uri)
+                    response = requests.get(uri, timeout=timeout)
                 break
             except:
                 if not self._silent:
@@ -69,9 +198,38 @@ class GitClass(object):
                 time.sleep(1)
         return response
 
+
+    def _probe_uri(self, uri):
+        """ Does a single request, without retries, returning None
+            if the server can't be contacted """
+        remaining = self._remaining_time()
+        timeout = 10 if remaining is None else min(10, remaining)
+        try:
+            return requests.get(uri, timeout = timeout)
+        except requests.exceptions.RequestException:
+            return None
+
+
+    def _probe_json(self, uri):
+        """ Returns the JSON content of URI, or None if it fails """
+        response = self._probe_uri(uri)
+        if (response is None) or (response.status_code != 200):
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+
     def _stop_download(self, data):
+        if self._current_tag is None:
+            return False
+        for entry in data:
+            if ('name' in entry) and (self._current_tag == entry['name']):
+                return True
         return False
 
+
     def _read_pages(self, uri):
         elements = []
         while uri is not None:
@@ -111,20 +269,19 @@ class GitClass(object):
         return data
 
 
-    def _get_uri(self, repository, min_elements):
-        repository = repository.strip()
-        if repository[-4:] == '.git':
-            repository = repository[:-4]
-        uri = urllib.parse.urlparse(repository)
-        elements = uri.path.split("/")
-        if (uri.scheme != 'http') and (uri.scheme != 'https') and (uri.scheme != 'git'):
-            print(f"{self._colors.critical}Unrecognized protocol in repository {repository}{self._colors.reset}")
-            return None
-        elements = uri.path.split("/")
-        if len(elements) < min_elements:
-            print(f"{self._colors.critical}Invalid uri format for repository {repository}{self._colors.reset}")
-            return None
-        return uri
+    def _parse_date(self, date):
+        """ Parses an ISO 8601 date. Before Python 3.11, fromisoformat()
+            doesn't accept the 'Z' suffix, so it is replaced """
+        if date[-1:] == 'Z':
+            date = date[:-1] + '+00:00'
+        return datetime.datetime.fromisoformat(date)
+
+
+    def _base_url(self, uri):
+        """ Returns the URL of the web server of the repository. For git://
+            repositories it is presumed to be HTTPS """
+        scheme = 'https' if uri.scheme == 'git' else uri.scheme
+        return scheme + '://' + uri.netloc
 
 
     def _rb(self, text):
@@ -151,42 +308,16 @@ class GitClass(object):
 
 class Github(GitClass):
     def __init__(self, silent = False):
-        super().__init__("github", silent)
+        super().__init__("github", silent, ["github.com", "www.github.com"])
         self._api_url = 'https://api.github.com/repos/'
 
 
-    def _is_github(self, repository):
-        uri = self._get_uri(repository, 3)
-        if uri is None:
-            return None
-        if (uri.netloc != "github.com") and (uri.netloc != "www.github.com"):
-            return None
-        return uri
-
-
-    def get_branches(self, repository):
-        uri = self._is_github(repository)
-        if uri is None:
-            return None
-
+    def get_branches(self, uri):
         branch_command = self.join_url(self._api_url, uri.path, 'branches')
         return self._read_pages(branch_command)
 
 
-    def _stop_download(self, data):
-        if self._current_tag is None:
-            return False
-        for entry in data:
-            if ('name' in entry) and (self._current_tag == entry['name']):
-                return True
-        return False
-
-
-    def get_tags(self, repository, current_tag = None):
-        uri = self._is_github(repository)
-        if uri is None:
-            return None
-
+    def get_tags(self, uri, current_tag = None):
         self._current_tag = current_tag
         tag_command = self.join_url(self._rb(self._api_url), self._rb(uri.path), 'tags?sort=created&direction=desc')
         data = self._read_pages(tag_command)
@@ -210,16 +341,7 @@ class Github(GitClass):
 
 class Gitlab(GitClass):
     def __init__(self, silent = False):
-        super().__init__("gitlab", silent)
-
-
-    def _is_gitlab(self, repository):
-        uri = self._get_uri(repository, 3)
-        if uri is None:
-            return None
-        if "gitlab" not in uri.netloc:
-            return None
-        return uri
+        super().__init__("gitlab", silent, ["gitlab.com"])
 
 
     def _project_name(self, uri):
@@ -229,12 +351,17 @@ class Gitlab(GitClass):
         return name.replace('/', '%2F')
 
 
-    def get_branches(self, repository):
-        uri = self._is_gitlab(repository)
-        if uri is None:
-            return None
+    def _project_url(self, uri):
+        return self.join_url(self._base_url(uri), 'api/v4/projects', self._project_name(uri))
+
+
+    def probe(self, uri):
+        data = self._probe_json(self._project_url(uri))
+        return isinstance(data, dict) and ('path_with_namespace' in data)
+
 
-        branch_command = self.join_url(uri.scheme + '://', uri.netloc, 'api/v4/projects', self._project_name(uri), 'repository/branches')
+    def get_branches(self, uri):
+        branch_command = self.join_url(self._project_url(uri), 'repository/branches')
         data = self._read_pages(branch_command)
         branches = []
         for branch in data:
@@ -242,52 +369,299 @@ class Gitlab(GitClass):
         return branches
 
 
-    def _stop_download(self, data):
-        if self._current_tag is None:
-            return False
-        for entry in data:
-            if ('name' in entry) and (self._current_tag == entry['name']):
-                return True
-        return False
+    def get_tags(self, uri, current_tag = None):
+        self._current_tag = current_tag
+        tag_command = self.join_url(self._project_url(uri), 'repository/tags?order_by=updated&sort=desc')
+        data = self._read_pages(tag_command)
+        self._current_tag = None
+        tags = []
+        for tag in data:
+            tags.append({"name": tag['name'],
+                         "date": self._parse_date(tag['commit']['committed_date'])})
+        self._colors.clear_line()
+        return tags
 
 
-    def get_tags(self, repository, current_tag = None):
-        uri = self._is_gitlab(repository)
-        if uri is None:
-            return None
+class Gitea(GitClass):
+    """ Backend for Gitea and Forgejo servers, which share the same API """
+    def __init__(self, silent = False):
+        super().__init__("gitea", silent, ["gitea.com", "codeberg.org"])
+
+
+    def _repo_url(self, uri):
+        return self.join_url(self._base_url(uri), 'api/v1/repos', self._rb(uri.path))
+
+
+    def probe(self, uri):
+        data = self._probe_json(self.join_url(self._base_url(uri), 'api/v1/version'))
+        return isinstance(data, dict) and ('version' in data)
+
 
+    def get_branches(self, uri):
+        branch_command = self.join_url(self._repo_url(uri), 'branches')
+        data = self._read_pages(branch_command)
+        branches = []
+        for branch in data:
+            branches.append({"name": branch['name'],
+                             "date": self._parse_date(branch['commit']['timestamp'])})
+        return branches
+
+
+    def get_tags(self, uri, current_tag = None):
         self._current_tag = current_tag
-        tag_command = self.join_url(uri.scheme + '://', uri.netloc, 'api/v4/projects', self._project_name(uri), 'repository/tags?order_by=updated&sort=desc')
+        tag_command = self.join_url(self._repo_url(uri), 'tags')
         data = self._read_pages(tag_command)
+        self._current_tag = None
         tags = []
         for tag in data:
+            if 'created' in tag['commit']:
+                date = tag['commit']['created']
+            else:
+                # old servers don't include the date in the tag list
+                commit_info = self._read_page(self.join_url(self._repo_url(uri), 'git/commits', tag['commit']['sha']))
+                if commit_info is None:
+                    continue
+                date = commit_info['commit']['committer']['date']
             tags.append({"name": tag['name'],
-                         "date": datetime.datetime.fromisoformat(tag['commit']['committed_date'])})
+                         "date": self._parse_date(date)})
         self._colors.clear_line()
         return tags
 
 
+class Cgit(GitClass):
+    """ Backend for repositories published with cgit. It has no API, so
+        the tags and branches are extracted from the 'refs' HTML pages.
+        The repository URI must be the one of the cgit web page. """
+    def __init__(self, silent = False):
+        super().__init__("cgit", silent)
+        self._repo_urls = {}
+
+
+    def _get_repo_urls(self, uri):
+        """ The URI arrives without the '.git' suffix, but some cgit servers,
+            like git.kernel.org, keep it in the repository path, so both
+            forms are tried until one of them works """
+        url = self.join_url(self._base_url(uri), uri.path)
+        if url in self._repo_urls:
+            return [self._repo_urls[url]]
+        return [url, url + '.git']
+
+
+    def probe(self, uri):
+        for url in self._get_repo_urls(uri):
+            response = self._probe_uri(url)
+            if (response is None) or (response.status_code != 200):
+                continue
+            if re.search("<meta name=['\"]generator['\"] content=['\"]cgit", response.text) is not None:
+                self._repo_urls[self.join_url(self._base_url(uri), uri.path)] = url
+                return True
+        return False
+
+
+    def _read_refs(self, uri, refs, link):
+        """ Returns the name and date of each entry in a refs page. LINK
+            is the kind of link used by cgit for the names ('tag' for tags
+            and 'log' for branches) """
+        for url in self._get_repo_urls(uri):
+            response = self._read_uri(self.join_url(url, 'refs', refs))
+            if response.status_code == 200:
+                self._repo_urls[self.join_url(self._base_url(uri), uri.path)] = url
+                break
+        else:
+            if not self._silent:
+                print(f"{self._colors.critical}Status code {response.status_code} when asking for {uri.geturl()}{self._colors.reset}")
+            return []
+        elements = []
+        for row in response.text.split("<tr"):
+            name = re.search(f"<a href=['\"][^'\"]*/{link}/[?]h=[^'\"]*['\"]>([^<]+)</a>", row)
+            date = re.search("title=['\"]([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2} [+-][0-9]{4})['\"]", row)
+            if (name is None) or (date is None):
+                continue
+            elements.append({"name": html.unescape(name.group(1)),
+                             "date": datetime.datetime.strptime(date.group(1), "%Y-%m-%d %H:%M:%S %z")})
+        self._colors.clear_line()
+        return elements
+
+
+    def get_branches(self, uri):
+        return self._read_refs(uri, 'heads', 'log')
+
+
+    def get_tags(self, uri, current_tag = None):
+        return self._read_refs(uri, 'tags', 'tag')
+
+
+class Forges(object):
+    """ Contains all the backends, and finds which one manages each
+        repository. The backend of a host not known beforehand is found
+        by probing the host with each backend, and it is stored in the
+        cache, so it is done only once. Repositories that no backend
+        supports are also stored, but only for UNSUPPORTED_EXPIRATION
+        seconds, in case it was a temporary failure. """
+
+    UNSUPPORTED_EXPIRATION = 24 * 60 * 60
+
+    def __init__(self, silent = False, cache = None):
+        super().__init__()
+        self._colors = Colors()
+        self._cache = cache if cache is not None else Cache()
+        self._backends = [Github(silent), Gitlab(silent), Gitea(silent), Cgit(silent)]
+        self._repositories = {}
+
+
+    def set_deadline(self, deadline):
+        for backend in self._backends:
+            backend.set_deadline(deadline)
+
+
+    def set_secrets(self, secrets):
+        for backend in self._backends:
+            backend.set_secrets(secrets)
+
+
+    def set_secret(self, backend_type, secret, value):
+        for backend in self._backends:
+            if backend.get_type() == backend_type:
+                backend.set_secret(secret, value)
+                return True
+        return False
+
+
+    def _get_uri(self, repository, min_elements):
+        repository = repository.strip()
+        if repository[-4:] == '.git':
+            repository = repository[:-4]
+        uri = urllib.parse.urlparse(repository)
+        if (uri.scheme != 'http') and (uri.scheme != 'https') and (uri.scheme != 'git'):
+            print(f"{self._colors.critical}Unrecognized protocol in repository {repository}{self._colors.reset}")
+            return None
+        elements = uri.path.split("/")
+        if len(elements) < min_elements:
+            print(f"{self._colors.critical}Invalid uri format for repository {repository}{self._colors.reset}")
+            return None
+        return uri
+
+
+    def _find_backend(self, repository, uri):
+        host = uri.netloc.lower()
+        for backend in self._backends:
+            if backend.is_known_host(host):
+                return backend
+        backend_type = self._cache.get("hosts", host)
+        for backend in self._backends:
+            if backend.get_type() == backend_type:
+                return backend
+        # some probes, like the Gitlab one, depend on the repository and
+        # not only on the host, so failures are stored per repository
+        key = normalize_repository(repository)
+        expiration = self._cache.get("unsupported", key)
+        if (expiration is not None) and (expiration > time.time()):
+            return None
+        for backend in self._backends:
+            if backend.probe(uri):
+                self._cache.set("hosts", host, backend.get_type())
+                return backend
+        self._cache.set("unsupported", key, time.time() + self.UNSUPPORTED_EXPIRATION)
+        return None
+
+
+    def get_backend(self, repository):
+        """ Returns the backend for the repository and its parsed URI """
+        if repository not in self._repositories:
+            uri = self._get_uri(repository, 2)
+            backend = self._find_backend(repository, uri) if uri is not None else None
+            self._repositories[repository] = (backend, uri)
+        return self._repositories[repository]
+
+
 class Snapcraft(object):
-    def __init__(self, silent):
+    def __init__(self, silent, cache = None, forges = None):
         super().__init__()
         self._colors = Colors()
         self._secrets = {}
         self._config = None
         self.silent = silent
         self._last_part = None
-        self._github = Github(silent)
-        self._gitlab = Gitlab(silent)
+        self._shard = None
+        self._deadline = None
+        self._cache = cache if cache is not None else Cache()
+        # the Forges object can be shared between snaps, to reuse
+        # the backends found for each repository
+        self._forges = forges if forges is not None else Forges(silent, self._cache)
 
 
     def set_secret(self, backend, key, value):
-        if backend == 'github':
-            self._github.set_secret(key, value)
-        elif backend == 'gitlab':
-            self._gitlab.set_secret(key, value)
-        else:
+        if not self._forges.set_secret(backend, key, value):
             print(f"Unknown backend: {backend}")
 
 
+    def set_shard(self, index, count):
+        """ Only the parts assigned to shard INDEX (starting at 1) of
+            COUNT will be processed """
+        self._shard = (index, count)
+
+
+    def set_deadline(self, deadline):
+        """ After DEADLINE (a time.monotonic() value), the remaining parts
+            will be marked as timed out instead of being checked """
+        self._deadline = deadline
+        self._forges.set_deadline(deadline)
+
+
+    def get_parts(self):
+        if self._config is None:
+            return []
+        return list(self._config['parts'])
+
+
+    def get_priority(self, part):
+        """ Parts with higher priority are checked first """
+        if (self._config is None) or (part not in self._config['parts']):
+            return 0
+        return self._config['parts'][part].get('priority', 0)
+
+
+    def get_expected_cost(self, part):
+        """ Returns the time, in seconds, that took to check this part in
+            the last run, or None if it is unknown """
+        if (self._config is None) or (part not in self._config['parts']):
+            return None
+        data = self._config['parts'][part]
+        if 'source' not in data:
+            return None
+        history = self._cache.get("repositories", normalize_repository(data['source']))
+        if (not isinstance(history, dict)) or ('latency' not in history):
+            return None
+        return history['latency']
+
+
+    def _store_latency(self, source, latency, lower_bound = False):
+        """ Stores in the cache the time that took to check a repository.
+            If LOWER_BOUND is True, the check didn't finish, so the real
+            time is at least LATENCY, or the previous value if higher """
+        key = normalize_repository(source)
+        if lower_bound:
+            history = self._cache.get("repositories", key)
+            if isinstance(history, dict) and ('latency' in history):
+                latency = max(latency, history['latency'])
+        self._cache.set("repositories", key, {"latency": round(latency, 3)})
+
+
+    def _in_shard(self, part):
+        """ Parts are assigned to a shard based on their normalized
+            repository URI, so all the parts that use the same repository
+            are always processed by the same worker """
+        if self._shard is None:
+            return True
+        data = self._config['parts'][part]
+        if 'source' in data:
+            key = normalize_repository(data['source'])
+        else:
+            key = part
+        index, count = self._shard
+        return (zlib.crc32(key.encode('utf-8')) % count) == (index - 1)
+
+
     def load_local_file(self, filename = None):
         """ Given a path/filename, will load the corresponding SNAPCRAFT.YAML file """
         if filename is None:
@@ -304,6 +678,7 @@ class Snapcraft(object):
             with open(filename, "r") as f:
                 data = f.read()
             self._open_yaml_file_with_extensions(data, "updatesnap")
+            self._check_priorities()
         self._load_secrets(filename)
 
 
@@ -312,10 +687,10 @@ class Snapcraft(object):
 
         self._load_secrets(None)
         self._open_yaml_file_with_extensions(data, "updatesnap")
+        self._check_priorities()
         if secrets:
             self._secrets = yaml.safe_load(secrets)
-            self._github.set_secrets(self._secrets)
-            self._gitlab.set_secrets(self._secrets)
+            self._forges.set_secrets(self._secrets)
 
 
     def _open_yaml_file_with_extensions(self, data, ext_name):
@@ -357,6 +732,18 @@ class Snapcraft(object):
         self._config = yaml.safe_load(newfile)
 
 
+    def _check_priorities(self):
+        """ Replaces any priority that isn't an integer with 0 """
+        for part, data in self._config['parts'].items():
+            if (not isinstance(data, dict)) or ('priority' not in data):
+                continue
+            priority = data['priority']
+            if isinstance(priority, int) and not isinstance(priority, bool):
+                continue
+            print(f"{self._colors.warning}Invalid priority '{priority}' in part {part}; it must be an integer. Using 0.{self._colors.reset}")
+            data['priority'] = 0
+
+
     def _load_secrets(self, filename):
         secrets_file = os.path.expanduser('~/.config/updatesnap/updatesnap.secrets')
         if os.path.exists(secrets_file):
@@ -368,8 +755,7 @@ class Snapcraft(object):
                 if os.path.exists(secrets_file):
                     with open(secrets_file, "r") as cfg:
                         self._secrets = yaml.safe_load(cfg)
-        self._github.set_secrets(self._secrets)
-        self._gitlab.set_secrets(self._secrets)
+        self._forges.set_secrets(self._secrets)
 
 
     def _print_message(self, part, message, source = None):
@@ -384,19 +770,17 @@ class Snapcraft(object):
 
 
     def _get_tags(self, source, current_tag = None):
-        tags = self._github.get_tags(source, current_tag)
-        if tags is not None:
-            return tags
-        tags = self._gitlab.get_tags(source, current_tag)
-        return tags
+        backend, uri = self._forges.get_backend(source)
+        if backend is None:
+            return None
+        return backend.get_tags(uri, current_tag)
 
 
     def _get_branches(self, source):
-        branches = self._github.get_branches(source)
-        if branches is not None:
-            return branches
-        branches = self._gitlab.get_branches(source)
-        return branches
+        backend, uri = self._forges.get_backend(source)
+        if backend is None:
+            return None
+        return backend.get_branches(uri)
 
 
     def _read_number(self, text):
@@ -452,10 +836,8 @@ class Snapcraft(object):
 
 
     def process_parts(self):
-        if self._config is None:
-            return []
         parts = []
-        for part in self._config['parts']:
+        for part in self.get_parts():
             parts.append(self.process_part(part))
         return parts
 
@@ -467,12 +849,16 @@ class Snapcraft(object):
             "use_branch": False,
             "use_tag": False,
             "missing_format": False,
+            "timed_out": False,
+            "unsupported": False,
             "updates": []
         }
         if self._config is None:
             return None
         if part not in self._config['parts']:
             return None
+        if not self._in_shard(part):
+            return None
         data = self._config['parts'][part]
         if 'source' not in data:
             return None
@@ -503,11 +889,39 @@ class Snapcraft(object):
                 return part_data
 
         self._print_message(part, None, source = source)
+        start_time = time.monotonic()
+        try:
+            self._check_part(part, data, source, part_data)
+        except DeadlineExceeded:
+            self._colors.clear_line()
+            self._print_message(part, f"{self._colors.critical}Timed out{self._colors.reset}")
+            part_data["timed_out"] = True
+            # store the time spent, so the next runs schedule this part
+            # later; but not if it didn't even start before the deadline
+            if (self._deadline is not None) and (start_time < self._deadline):
+                self._store_latency(source, time.monotonic() - start_time, lower_bound = True)
+            if not self.silent:
+                print()
+            return part_data
+        if not part_data["unsupported"]:
+            self._store_latency(source, time.monotonic() - start_time)
+        if not self.silent:
+            print()
+        return part_data
+
+
+    def _check_part(self, part, data, source, part_data):
+        """ Does the network requests for a part and fills PART_DATA
+            with the results """
         if 'source-tag' in data:
             current_tag = data['source-tag']
         else:
             current_tag = None
         tags = self._get_tags(source, current_tag)
+        if tags is None:
+            self._print_message(part, f"{self._colors.critical}Repository not supported by any backend{self._colors.reset}", source = source)
+            part_data["unsupported"] = True
+            return
 
         if ('source-tag' not in data) and ('source-branch' not in data):
             self._print_message(part, f"{self._colors.warning}Has neither a source-tag nor a source-branch{self._colors.reset}", source = source)
@@ -528,9 +942,6 @@ class Snapcraft(object):
             self._sort_elements(part, current_version, branches, "branch")
             self._print_message(part, f"{self._colors.note}Should be moved to an specific tag{self._colors.reset}")
             self._print_last_tags(part, tags)
-        if not self.silent:
-            print()
-        return part_data
 
 
     def _print_last_tags(self, part, tags):
@@ -633,34 +1044,68 @@ def apply_local_secrets(snap):
     return
 
 
-def process_folder(folder):
+def get_jobs(snap, parts = None):
+    """ Returns a list of (snap, part) tuples with the parts to check. If
+        PARTS is empty, all the parts in the snap are checked """
+    if not parts:
+        parts = snap.get_parts()
+    return [(snap, part) for part in parts]
+
+
+def load_folder(folder, cache, forges, shard = None, deadline = None):
     global arguments
 
-    snap = Snapcraft(arguments.s)
+    snap = Snapcraft(arguments.s, cache, forges)
     snap.load_local_file(folder)
     apply_local_secrets(snap);
-    if len(arguments.parts) >= 1:
-        retdata = []
-        for a in arguments.parts:
-            retdata.append(snap.process_part(a))
-        return retdata
-    else:
-        return snap.process_parts()
+    if shard is not None:
+        snap.set_shard(*shard)
+    snap.set_deadline(deadline)
+    return get_jobs(snap, arguments.parts)
 
 
-def process_data(data):
+def load_data(data, cache, forges, shard = None, deadline = None):
     global arguments
 
-    snap = Snapcraft(arguments.s)
+    snap = Snapcraft(arguments.s, cache, forges)
     snap.load_external_data(data)
     apply_local_secrets(snap)
-    if len(arguments.parts) >= 1:
-        retdata = []
-        for a in arguments.parts:
-            retdata.append(snap.process_part(a))
-        return retdata
+    if shard is not None:
+        snap.set_shard(*shard)
+    snap.set_deadline(deadline)
+    return get_jobs(snap, arguments.parts)
+
+
+def schedule_jobs(jobs, deadline = None):
+    """ Returns the order in which the jobs must be processed: first those
+        with higher priority and, if there is a deadline, the cheapest
+        ones first, based on the time that they took in previous runs.
+        Parts never checked before are presumed to take the average time. """
+    costs = [snap.get_expected_cost(part) for snap, part in jobs]
+    known_costs = [cost for cost in costs if cost is not None]
+    if len(known_costs) != 0:
+        default_cost = sum(known_costs) / len(known_costs)
     else:
-        return snap.process_parts()
+        default_cost = 0
+
+    def job_key(position):
+        snap, part = jobs[position]
+        if deadline is None:
+            return (-snap.get_priority(part), position)
+        cost = costs[position] if costs[position] is not None else default_cost
+        return (-snap.get_priority(part), cost, position)
+
+    return sorted(range(len(jobs)), key=job_key)
+
+
+def process_jobs(jobs, deadline = None):
+    """ Checks all the parts, returning the results in the same order than
+        the jobs, independently of the order in which they were processed """
+    results = [None] * len(jobs)
+    for position in schedule_jobs(jobs, deadline):
+        snap, part = jobs[position]
+        results[position] = snap.process_part(part)
+    return results
 
 
 def print_summary(data):
@@ -671,6 +1116,14 @@ def print_summary(data):
         if printed_line:
             print()
             printed_line = False
+        if entry.get("timed_out", False):
+            print(f"{entry['name']}: timed out before finishing the check.")
+            printed_line = True
+            continue
+        if entry.get("unsupported", False):
+            print(f"{entry['name']}: repository not supported.")
+            printed_line = True
+            continue
         if entry["missing_format"]:
             print(f"{entry['name']}: needs version format definition.")
             printed_line = True
@@ -688,33 +1141,125 @@ def print_summary(data):
             print(f"    {update['name']} (tagget at {update['date']})")
 
 
-parser = argparse.ArgumentParser(prog="Update Snap",
-                                 description="Find the lastest source versions for snap files.")
-parser.add_argument('-s', action='store_true', help='Silent output.')
-parser.add_argument('-r', action='store_true', help='Process all the snaps recursively from the specified folder.')
-parser.add_argument('--github-user', action='store', help='User name for accesing Github projects.')
-parser.add_argument('--github-token', action='store', help='Access token for accesing Github projects.')
-parser.add_argument('folder', default='.', help='The folder of the snapcraft project.')
-parser.add_argument('parts', nargs='*', help='A list of parts to check.')
-arguments = parser.parse_args(sys.argv[1:])
-
-if arguments.r: # recursive
-    if arguments.folder.startswith("http://") or arguments.folder.startswith("https://"):
-        print(f"-r parameter can't be used with http or https. Aborting.")
-        sys.exit(-1)
-    retval = []
-    for folder in os.listdir(arguments.folder):
-        full_path = os.path.join(arguments.folder, folder)
-        if not os.path.isdir(full_path):
+def write_results(filename, data, shard):
+    """ Stores the results of a (maybe partial) run in a file, to be combined
+        later with the results of the other shards using --merge. The position
+        of each part is kept to allow to rebuild the original order """
+    parts = []
+    for position, entry in enumerate(data):
+        if entry is None:
             continue
-        retval += process_folder(full_path)
-else:
-    if (not arguments.folder.startswith("http://")) and (not arguments.folder.startswith("https://")):
-        retval = process_folder(arguments.folder)
-    else:
-        response = requests.get(arguments.folder)
-        if not response:
-            print(f"Failed to get the file {arguments.folder}: {response.status_code}")
+        entry = dict(entry)
+        entry["position"] = position
+        if entry["version"] is not None:
+            entry["version"] = list(entry["version"])
+        parts.append(entry)
+    if shard is None:
+        shard = (1, 1)
+    with open(filename, "w") as f:
+        yaml.safe_dump({"shard": list(shard), "parts": parts}, f)
+
+
+def merge_results(filenames):
+    """ Combines the files written by several sharded runs into a single
+        list of results, in the same order than a non-sharded run """
+    colors = Colors()
+    count = None
+    shards = set()
+    parts = []
+    for filename in filenames:
+        with open(filename, "r") as f:
+            data = yaml.safe_load(f)
+        index, shard_count = data["shard"]
+        if count is None:
+            count = shard_count
+        elif count != shard_count:
+            print(f"{colors.critical}File {filename} belongs to a run with {shard_count} shards instead of {count}. Aborting.{colors.reset}")
             sys.exit(-1)
-        retval = process_data(response.content.decode('utf-8'))
-print_summary(retval)
+        if index in shards:
+            print(f"{colors.warning}Shard {index}/{count} is duplicated; ignoring {filename}.{colors.reset}")
+            continue
+        shards.add(index)
+        parts += data["parts"]
+    if count is not None:
+        for index in range(1, count + 1):
+            if index not in shards:
+                print(f"{colors.warning}Missing results for shard {index}/{count}.{colors.reset}")
+    parts.sort(key=lambda x: x["position"])
+    for entry in parts:
+        del entry["position"]
+        if entry["version"] is not None:
+            entry["version"] = tuple(entry["version"])
+    return parts
+
+
+def shard_value(text):
+    elements = text.split("/")
+    try:
+        if len(elements) != 2:
+            raise ValueError
+        index = int(elements[0])
+        count = int(elements[1])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{text}'; must be in K/N format")
+    if (count < 1) or (index < 1) or (index > count):
+        raise argparse.ArgumentTypeError(f"invalid shard '{text}'; K must be between 1 and N")
+    return (index, count)
+
+
+def main():
+    global arguments
+
+    parser = argparse.ArgumentParser(prog="Update Snap",
+                                     description="Find the lastest source versions for snap files.")
+    parser.add_argument('-s', action='store_true', help='Silent output.')
+    parser.add_argument('-r', action='store_true', help='Process all the snaps recursively from the specified folder.')
+    parser.add_argument('--github-user', action='store', help='User name for accesing Github projects.')
+    parser.add_argument('--github-token', action='store', help='Access token for accesing Github projects.')
+    parser.add_argument('--cache', action='store', default=os.path.expanduser('~/.cache/updatesnap/updatesnap.cache'),
+                        help='File where to store data between runs, like the backend used by each host.')
+    parser.add_argument('--shard', action='store', type=shard_value, help='Process only the parts assigned to shard K of N, in K/N format.')
+    parser.add_argument('--deadline', action='store', type=float,
+                        help='Maximum time, in seconds, for checking the parts. Those not checked in time are marked as timed out.')
+    parser.add_argument('--output', action='store', help='Write the results to a file, to be combined with other shards using --merge.')
+    parser.add_argument('--merge', action='store', nargs='+', metavar='FILE',
+                        help='Show the combined summary of the files written with --output by several shards, instead of checking any snap.')
+    parser.add_argument('folder', nargs='?', default='.', help='The folder of the snapcraft project.')
+    parser.add_argument('parts', nargs='*', help='A list of parts to check.')
+    arguments = parser.parse_args(sys.argv[1:])
+    if arguments.merge:
+        print_summary(merge_results(arguments.merge))
+        return
+    cache = Cache(arguments.cache)
+    forges = Forges(arguments.s, cache)
+    deadline = time.monotonic() + arguments.deadline if arguments.deadline is not None else None
+
+    if arguments.r: # recursive
+        if arguments.folder.startswith("http://") or arguments.folder.startswith("https://"):
+            print(f"-r parameter can't be used with http or https. Aborting.")
+            sys.exit(-1)
+        jobs = []
+        # sorted, to ensure that all the shards see the parts in the same order
+        for folder in sorted(os.listdir(arguments.folder)):
+            full_path = os.path.join(arguments.folder, folder)
+            if not os.path.isdir(full_path):
+                continue
+            jobs += load_folder(full_path, cache, forges, arguments.shard, deadline)
+    else:
+        if (not arguments.folder.startswith("http://")) and (not arguments.folder.startswith("https://")):
+            jobs = load_folder(arguments.folder, cache, forges, arguments.shard, deadline)
+        else:
+            response = requests.get(arguments.folder)
+            if not response:
+                print(f"Failed to get the file {arguments.folder}: {response.status_code}")
+                sys.exit(-1)
+            jobs = load_data(response.content.decode('utf-8'), cache, forges, arguments.shard, deadline)
+    retval = process_jobs(jobs, deadline)
+    cache.save()
+    if arguments.output:
+        write_results(arguments.output, retval, arguments.shard)
+    print_summary(retval)
+
+
+if __name__ == '__main__':
+    main()